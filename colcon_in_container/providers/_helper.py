@@ -13,7 +13,14 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from functools import lru_cache
 from platform import processor
+import shutil
+import signal
+import subprocess
+
+from colcon_in_container.logging import logger
+from colcon_in_container.providers import exceptions
 
 
 _ros2_ubuntu_distro = {'rolling': 'noble',
@@ -27,8 +34,12 @@ def get_ubuntu_distro(ros_distro):
     return _ros2_ubuntu_distro[ros_distro]
 
 
+@lru_cache(maxsize=None)
 def host_architecture():
-    """Return the host CPU architecture."""
+    """Return the host CPU architecture.
+
+    The result is cached since the processor lookup may spawn a process.
+    """
     processor_architecture = {'x86_64': 'amd64',
                               'aarch64': 'arm64'}
     host_processor = processor()
@@ -36,3 +47,46 @@ def host_architecture():
         raise SystemError(f'Architecture {host_processor} is not supported')
 
     return processor_architecture[host_processor]
+
+
+def pipe_commands(producer_command, consumer_command):
+    """Pipe the output of the producer command into the consumer command.
+
+    Returns the return codes of the producer and the consumer.
+    """
+    logger.debug(f'Executing on host: {" ".join(producer_command)} | '
+                 f'{" ".join(consumer_command)}')
+    # The producer must not read the terminal, lxc and multipass exec
+    # would forward it to the instance
+    with subprocess.Popen(producer_command,
+                          stdin=subprocess.DEVNULL,
+                          stdout=subprocess.PIPE) as producer:
+        # Make mypy happy
+        assert producer.stdout is not None
+
+        consumer = subprocess.run(consumer_command, stdin=producer.stdout)
+        # Close our end of the pipe so the producer does not block
+        # if the consumer exited early
+        producer.stdout.close()
+    return producer.returncode, consumer.returncode
+
+
+def check_pipe_download(return_codes, *, instance_path, host_path):
+    """Check the return codes of a download from the instance to the host.
+
+    The partially extracted host_path is removed on failure.
+    Raise FileNotFoundInInstanceError when the instance side failed,
+    the host side then only fails on the empty stream.
+    Raise ProviderClientError when only the host side failed.
+    """
+    if not any(return_codes):
+        return
+
+    shutil.rmtree(host_path, ignore_errors=True)
+    producer_return_code, consumer_return_code = return_codes
+    # A producer killed by SIGPIPE only reflects the consumer exiting early
+    if producer_return_code and producer_return_code != -signal.SIGPIPE:
+        raise exceptions.FileNotFoundInInstanceError(instance_path)
+    raise exceptions.ProviderClientError(
+        f'Failed to download {instance_path} into {host_path}. '
+        f'tar failed with the return codes: {return_codes}')
@@ -13,26 +13,68 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from concurrent.futures import ThreadPoolExecutor
 import json
 import os
 from platform import system
+import shlex
 import shutil
 import stat
 import subprocess
+import threading
 from typing import Any, Dict
 
 from colcon_in_container.logging import logger
 from colcon_in_container.providers import exceptions
 from colcon_in_container.providers._helper \
-    import host_architecture
+    import check_pipe_download, host_architecture, pipe_commands
 from colcon_in_container.providers.provider import Provider
 from pylxd import Client, exceptions as pylxd_exceptions
 
 
+# Buffer size used when copying file content, large enough to keep the
+# number of read/write calls low for big build artifacts
+_COPY_BUFFER_SIZE = 2 * 1024 * 1024
+
+# Directories larger than this are uploaded through a native tar pipe
+_NATIVE_TAR_THRESHOLD = 64 * 1024 * 1024
+
+# Number of files of a directory uploaded concurrently through the LXD API
+_FILE_UPLOAD_WORKERS = 4
+
+# Packages are uploaded concurrently and each upload has its own file
+# workers, so the uploads actually running are bounded process wide.
+# All threads share the requests Session of the pylxd client: this
+# relies on the Session not being modified once the client is created,
+# and on the connection pools of its adapter being thread safe.
+# A slot is either one upload request to the LXD API or one native tar
+# upload pipe. Downloads and commands executed in the instance do not
+# take a slot.
+_MAX_CONCURRENT_UPLOADS = 8
+_upload_slots = threading.BoundedSemaphore(_MAX_CONCURRENT_UPLOADS)
+
+# Tar blocking factor, in 512 bytes records, used by the native tar pipe
+_TAR_BLOCKING_FACTOR = '1024'
+
+
 def _is_lxd_installed():
     return shutil.which('lxd') is not None
 
 
+def _is_native_tar_available():
+    return shutil.which('lxc') is not None and shutil.which('tar') is not None
+
+
+def _is_directory_larger_than(path, size):
+    total_size = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            total_size += os.lstat(os.path.join(root, f)).st_size
+            if total_size > size:
+                return True
+    return False
+
+
 class LXDClient(Provider):
     """LXD client interacting with the LXD socket."""
 
@@ -54,9 +96,14 @@ class LXDClient(Provider):
                 f'Make sure LXD is properly installed and running: {e}'
             )
 
-        if not self._is_lxd_initialised():
-            raise exceptions.ProviderNotConfiguredError(
-                'LXD is not initialised. Please run `lxd init --auto`')
+        # Look for a previous instance while checking the LXD configuration,
+        # both are independent round-trips to the LXD socket
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            previous_instance_future = executor.submit(
+                self._get_previous_instance)
+            if not self._is_lxd_initialised():
+                raise exceptions.ProviderNotConfiguredError(
+                    'LXD is not initialised. Please run `lxd init --auto`')
 
         if self.ubuntu_distro == 'noble':
             # necessary due to
@@ -85,9 +132,8 @@ class LXDClient(Provider):
         with open(cloud_init_file, 'r') as f:
             config['config']['user.user-data'] = f.read()
 
-        if self.lxd_client.instances.exists(self.instance_name):
-            previous_instance = self.lxd_client.instances.get(
-                self.instance_name)
+        previous_instance = previous_instance_future.result()
+        if previous_instance:
             if previous_instance.status == 'Running':
                 previous_instance.stop(wait=True)
             else:
@@ -102,6 +148,16 @@ class LXDClient(Provider):
             if self.instance.status == 'Running':
                 self.instance.stop(wait=True)
 
+    def _get_previous_instance(self):
+        """Return the instance left by a previous run, if any.
+
+        A single lookup both checks the existence and fetches the instance.
+        """
+        try:
+            return self.lxd_client.instances.get(self.instance_name)
+        except pylxd_exceptions.NotFound:
+            return None
+
     def _is_lxd_initialised(self):
         devices = self.lxd_client.profiles.get('default').devices
         return bool(devices)
@@ -114,10 +170,14 @@ class LXDClient(Provider):
         ).exit_code
 
     def _recursive_get(self, remote_path, local_path):
+        # Stream the response so that files are written to disk as they
+        # are received instead of being held entirely in memory
         response = self.instance.files._endpoint.get(
-            params={'path': remote_path}, is_api=False)
+            params={'path': remote_path}, is_api=False, stream=True)
 
-        if 'X-LXD-type' in response.headers:
+        with response:
+            if 'X-LXD-type' not in response.headers:
+                return
             unix_permissions = int(response.headers['X-LXD-mode'], 8)
             if response.headers['X-LXD-type'] == 'directory':
                 os.mkdir(local_path, unix_permissions)
@@ -131,8 +191,17 @@ class LXDClient(Provider):
             elif response.headers['X-LXD-type'] == 'file':
                 fd = os.open(local_path, os.O_CREAT | os.O_WRONLY,
                              mode=unix_permissions)
+                response.raw.decode_content = True
                 with open(fd, 'wb') as f:
-                    f.write(response.content)
+                    shutil.copyfileobj(response.raw, f, _COPY_BUFFER_SIZE)
+
+    def _put_file(self, local_file, remote_file):
+        with open(local_file, 'rb') as fp:
+            unix_permissions = oct(os.stat(local_file).st_mode)[-3:]
+            # Pass the file object so its content is streamed
+            with _upload_slots:
+                self.instance.files.put(
+                    remote_file, fp, mode=unix_permissions)
 
     def _recursive_put(self, local_path, remote_path):
         norm_src = os.path.normpath(local_path)
@@ -140,37 +209,84 @@ class LXDClient(Provider):
             raise NotADirectoryError('src parameter must be a directory')
         idx = len(norm_src)
         dst_items = set()
-        for path, dirname, files in os.walk(norm_src):
-            dst_path = os.path.normpath(
-                os.path.join(remote_path, path[idx:].lstrip(os.path.sep))
-            )
-            # create directory or symbolic link
-            # (depending on what's there)
-            if path not in dst_items:
-                dst_items.add(path)
-                unix_permissions = oct(os.stat(path).st_mode)[-3:]
-                headers = self.instance.files._resolve_headers(
-                    mode=unix_permissions)
-                # determine what the file is:
-                # a directory or a symbolic link
-                file_mode = os.stat(path).st_mode
-                if stat.S_ISLNK(file_mode):
-                    headers['X-LXD-type'] = 'symlink'
-                else:
-                    headers['X-LXD-type'] = 'directory'
-                self.instance.files._endpoint.post(params={'path': dst_path},
-                                                   headers=headers)
-            # copy files
-            for f in files:
-                src_file = os.path.join(path, f)
-                with open(src_file, 'rb') as fp:
-                    filepath = os.path.join(dst_path, f)
-                    unix_permissions = oct(os.stat(src_file).st_mode)[-3:]
-                    self.instance.files.put(filepath, fp.read(),
-                                            mode=unix_permissions)
+        # Directories are created in walk order so that they exist before
+        # their files, which are uploaded concurrently
+        with ThreadPoolExecutor(max_workers=_FILE_UPLOAD_WORKERS) as executor:
+            uploads = []
+            for path, dirname, files in os.walk(norm_src):
+                dst_path = os.path.normpath(
+                    os.path.join(remote_path, path[idx:].lstrip(os.path.sep))
+                )
+                # create directory or symbolic link
+                # (depending on what's there)
+                if path not in dst_items:
+                    dst_items.add(path)
+                    unix_permissions = oct(os.stat(path).st_mode)[-3:]
+                    headers = self.instance.files._resolve_headers(
+                        mode=unix_permissions)
+                    # determine what the file is:
+                    # a directory or a symbolic link
+                    file_mode = os.stat(path).st_mode
+                    if stat.S_ISLNK(file_mode):
+                        headers['X-LXD-type'] = 'symlink'
+                    else:
+                        headers['X-LXD-type'] = 'directory'
+                    with _upload_slots:
+                        self.instance.files._endpoint.post(
+                            params={'path': dst_path}, headers=headers)
+                # copy files
+                for f in files:
+                    uploads.append(executor.submit(
+                        self._put_file,
+                        os.path.join(path, f),
+                        os.path.join(dst_path, f)))
+            # Propagate the first upload error, if any
+            for upload in uploads:
+                upload.result()
+
+    def _lxc_exec_command(self):
+        """Return the lxc command executing in the instance.
+
+        The instance is created through the local socket in the default
+        project, both are pinned instead of relying on the lxc remote and
+        project currently selected by the user.
+        """
+        return ['lxc', '--project', 'default',
+                'exec', f'local:{self.instance_name}', '--']
+
+    def _tar_get(self, remote_path, local_path):
+        """Download a directory through a native tar pipe."""
+        os.mkdir(local_path)
+        return_codes = pipe_commands(
+            [*self._lxc_exec_command(),
+             'tar', '-C', remote_path, '-b', _TAR_BLOCKING_FACTOR,
+             '-cf', '-', '.'],
+            ['tar', '-C', local_path, '-b', _TAR_BLOCKING_FACTOR, '-xf', '-'])
+        check_pipe_download(return_codes, instance_path=remote_path,
+                            host_path=local_path)
+
+    def _tar_put(self, local_path, remote_path):
+        """Upload a directory through a native tar pipe."""
+        quoted_remote_path = shlex.quote(remote_path)
+        with _upload_slots:
+            return_codes = pipe_commands(
+                ['tar', '-C', local_path, '-b', _TAR_BLOCKING_FACTOR,
+                 '-cf', '-', '.'],
+                [*self._lxc_exec_command(), 'sh', '-c',
+                 f'mkdir -p {quoted_remote_path} && '
+                 f'exec tar -C {quoted_remote_path} '
+                 f'-b {_TAR_BLOCKING_FACTOR} --no-same-owner -xf -'])
+        if any(return_codes):
+            raise exceptions.ProviderClientError(
+                f'Failed to upload {local_path} into {remote_path}. '
+                f'tar failed with the return codes: {return_codes}')
 
     def _copy_from_instance_to_host(self, *, instance_path, host_path):
         """Copy data from the instance to the host."""
+        if _is_native_tar_available():
+            self._tar_get(instance_path, host_path)
+            return
+
         try:
             self._recursive_get(instance_path, host_path)
         except pylxd_exceptions.NotFound:
@@ -178,12 +294,40 @@ class LXDClient(Provider):
 
     def _write_in_instance(self, *, instance_file_path, lines):
         """Copy data from the instance to the host."""
-        self.instance.files.put(instance_file_path, lines)
+        # Encode once so the payload is sent as is,
+        # the HTTP client would otherwise encode str bodies as latin-1
+        self.instance.files.put(instance_file_path, lines.encode('utf-8'))
 
     def _copy_from_host_to_instance(self, *, host_path, instance_path):
-        """Copy data from the instance to the host."""
-        self._recursive_put(host_path, instance_path)
+        """Copy data from the host to the instance.
+
+        Large directories go through a native tar pipe, small ones are
+        uploaded file by file with the LXD API to avoid spawning processes.
+        """
+        if _is_native_tar_available() and \
+                _is_directory_larger_than(host_path, _NATIVE_TAR_THRESHOLD):
+            self._tar_put(host_path, instance_path)
+        else:
+            self._recursive_put(host_path, instance_path)
+
+    def supports_bind_mount(self):
+        """Return whether host directories can be mounted in the instance."""
+        return True
+
+    def _mount_in_instance(self, mounts):
+        """Mount host directories read-only in the instance."""
+        # Refresh the instance configuration, save() sends it back whole
+        self.instance.sync()
+        for host_path, instance_path in mounts.items():
+            device_name = instance_path.strip('/').replace('/', '-')
+            self.instance.devices[device_name] = {
+                'type': 'disk',
+                'source': os.path.abspath(host_path),
+                'path': instance_path,
+                'readonly': 'true',
+            }
+        self.instance.save(wait=True)
 
     def shell(self):
         """Shell into the instance."""
-        subprocess.run(['lxc', 'exec', self.instance_name, '--', 'bash'])
+        subprocess.run([*self._lxc_exec_command(), 'bash'])
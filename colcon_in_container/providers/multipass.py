@@ -13,6 +13,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import logging
 import os
 from platform import machine
 import shutil
@@ -21,10 +22,24 @@ from typing import List
 
 from colcon_in_container.logging import logger
 from colcon_in_container.providers import exceptions
+from colcon_in_container.providers._helper \
+    import check_pipe_download, pipe_commands
 from colcon_in_container.providers.provider import Provider
 import jinja2
 
 
+# The environment caches the parsed template,
+# it is loaded from disk on first use only
+_jinja_environment = jinja2.Environment(
+    loader=jinja2.FileSystemLoader(os.path.join(
+        os.path.dirname(os.path.realpath(__file__)), 'config')),
+    auto_reload=False)
+
+
+# Maximum size of a single read of a command output
+_READ_SIZE = 64 * 1024
+
+
 def _get_multipass_path():
     return shutil.which('multipass')
 
@@ -41,10 +56,18 @@ class MultipassClient(Provider):
                 'Multipass is not installed.'
                 'Please run `sudo snap install multipass`')
 
-        self._render_jinja_template()
+        cloud_init_content = self._render_jinja_template()
 
-        if self._run(['info', self.instance_name]).returncode == 0:
-            self._clean_instance()
+        # Delete any previous instance directly rather than probing for it
+        # first. Most of the time there is none and the command fails,
+        # any other failure will surface when launching the instance.
+        completed_process = self._run(
+            ['delete', '--purge', self.instance_name],
+            stderr=subprocess.PIPE)
+        if completed_process.returncode:
+            logger.debug('No previous instance deleted (return code '
+                         f'{completed_process.returncode}): '
+                         f'{completed_process.stderr.decode("utf-8")}')
 
         cpus = os.getenv('COLCON_IN_CONTAINER_MULTIPASS_CPUS', default='2')
         mem = os.getenv('COLCON_IN_CONTAINER_MULTIPASS_MEMORY', default='4G')
@@ -58,19 +81,14 @@ class MultipassClient(Provider):
              '--cpus', cpus,
              '--memory', mem,
              '--disk', disk,
-             '--cloud-init', self.rendered_cloud_init_path,
-             '--timeout', '1000'], check=True)
-        self.execute_command(['cloud-init', 'status', '--wait'])
+             # stream the rendered cloud-init from memory over stdin
+             '--cloud-init', '-',
+             '--timeout', '1000'],
+            input=cloud_init_content.encode('utf-8'), check=True)
 
     def _render_jinja_template(self):
-        config_directory = os.path.join(
-            os.path.dirname(os.path.realpath(__file__)), 'config')
-        cloud_init_file = os.path.join(
-            config_directory, 'cloud-init.yaml')
-        with open(cloud_init_file, 'r') as f:
-            config = f.read()
-
-        template = jinja2.Environment().from_string(source=config)
+        """Return the rendered cloud-init configuration."""
+        template = _jinja_environment.get_template('cloud-init.yaml')
         host_architecture = machine()
         # support for windows 10 and 11 returning all kinds of values
         # bugs.python.org/issue7146
@@ -79,19 +97,11 @@ class MultipassClient(Provider):
         elif host_architecture in ['ARM64', 'arm64']:
             host_architecture = 'aarch64'
 
-        cloud_init_content = template.render(
+        return template.render(
             {'v1': {'machine': host_architecture,
                     'distro_release': self.ubuntu_distro}}
         )
 
-        self.rendered_cloud_init_path = '.colcon-in-container-cloud-init.yaml'
-        with open(self.rendered_cloud_init_path, 'w') as f:
-            written = f.write(cloud_init_content)
-            if not written:
-                raise exceptions.ProviderNotConfiguredError(
-                    'Failed to write cloud-init file '
-                    f'in {self.rendered_cloud_init_path}')
-
     def _run(self, command: List[str], **kwargs):
         """Execute a multipass command.
 
@@ -106,50 +116,75 @@ class MultipassClient(Provider):
         self._run(['delete', '--purge', self.instance_name])
 
     def execute_command(self, command: List[str]):
-        """Execute the given command inside the instance."""
-        completed_process = self._run(['exec', self.instance_name,
-                                       '--working-directory', '/ws',
-                                       '--', 'sudo', *command],
-                                      capture_output=True)
+        """Execute the given command inside the instance.
 
-        self.logger_instance.debug(completed_process.stdout.strip())
-        return completed_process.returncode
-
-    def _copy_from_instance_to_host(self, *, instance_path, host_path):
-        """Copy data from the instance to the host."""
-        command_result = self._run(['transfer', '--recursive', '--parents',
-                                    f'{self.instance_name}:{instance_path}',
-                                    host_path], check=True)
-        if command_result.returncode:
-            raise exceptions.FileNotFoundInInstanceError(instance_path)
+        The output is relayed to the instance logger while the command runs.
+        """
+        command = [str(self.multipass_path), 'exec', self.instance_name,
+                   '--working-directory', '/ws', '--', 'sudo', *command]
+        logger.debug(f'Executing on host: {" ".join(command)}')
 
-    def _write_in_instance(self, *, instance_file_path, lines):
-        """Write file in the instance."""
-        command = [self.multipass_path, 'transfer', '--parents',
-                   '-', f'{self.instance_name}:{instance_file_path}']
-        with subprocess.Popen(
-            command, stdin=subprocess.PIPE, stderr=subprocess.PIPE
-        ) as proc:
+        # Skip decoding and formatting entirely when nobody will see it
+        log_output = self.logger_instance.isEnabledFor(logging.DEBUG)
+        with subprocess.Popen(command, stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT) as proc:
             # Make mypy happy
-            assert proc.stdin is not None
-            assert proc.stderr is not None
+            assert proc.stdout is not None
+
+            pending = b''
+            while True:
+                data = os.read(proc.stdout.fileno(), _READ_SIZE)
+                if not data:
+                    break
+                if not log_output:
+                    continue
+                # Log the complete lines of each read as a single record
+                lines, _, pending = (pending + data).rpartition(b'\n')
+                if lines:
+                    self.logger_instance.debug(
+                        lines.decode('utf-8', errors='replace'))
+            if pending:
+                self.logger_instance.debug(
+                    pending.decode('utf-8', errors='replace'))
+        return proc.returncode
 
-            for line in lines:
-                proc.stdin.write(bytes(line, 'utf-8'))
+    def _copy_from_instance_to_host(self, *, instance_path, host_path):
+        """Copy data from the instance to the host.
 
-            # Close stdin before reading stderr, otherwise read() will hang
-            # because process is waiting for more data.
-            proc.stdin.close()
+        When tar is available on the host, the directory is streamed
+        through a single tar pipe instead of being transferred file by file.
+        """
+        if shutil.which('tar') is None:
+            command_result = self._run(
+                ['transfer', '--recursive', '--parents',
+                 f'{self.instance_name}:{instance_path}',
+                 host_path], check=True)
+            if command_result.returncode:
+                raise exceptions.FileNotFoundInInstanceError(instance_path)
+            return
+
+        os.makedirs(host_path)
+        return_codes = pipe_commands(
+            [str(self.multipass_path), 'exec', self.instance_name, '--',
+             'sudo', 'tar', '-C', instance_path, '-cf', '-', '.'],
+            ['tar', '-C', host_path, '-xf', '-'])
+        check_pipe_download(return_codes, instance_path=instance_path,
+                            host_path=host_path)
 
-            # Take one read of stderr in case there is anything useful
-            # for debugging an error.
-            stderr = proc.stderr.read()
+    def _write_in_instance(self, *, instance_file_path, lines):
+        """Write file in the instance."""
+        # Send the whole content at once, the scripts are small
+        completed_process = self._run(
+            ['transfer', '--parents',
+             '-', f'{self.instance_name}:{instance_file_path}'],
+            input=lines.encode('utf-8'), stderr=subprocess.PIPE)
 
-        if proc.returncode:
+        if completed_process.returncode:
             raise exceptions.ProviderClientError(
                 f'Failed to write data to destination {instance_file_path}. '
-                f'Failed withe return code: {proc.returncode} and'
-                f'stderr: {stderr.decode("utf-8")}'
+                'Failed withe return code: '
+                f'{completed_process.returncode} and'
+                f'stderr: {completed_process.stderr.decode("utf-8")}'
             )
 
     def _copy_from_host_to_instance(self, *, host_path, instance_path):
@@ -168,7 +203,8 @@ class MultipassClient(Provider):
             raise exceptions.FileNotFoundInInstanceError(instance_path)
 
         move_return_code = self.execute_command([
-            f'mv {temporary_instance_path}/* {instance_path}'])
+            f'mkdir -p {instance_path} && '
+            f'sudo mv {temporary_instance_path}/* {instance_path}'])
 
         if move_return_code:
             raise exceptions.FileNotFoundInInstanceError(
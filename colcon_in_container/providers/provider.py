@@ -22,6 +22,11 @@ from colcon_in_container.providers import exceptions
 from colcon_in_container.providers._helper import get_ubuntu_distro
 
 
+def _instance_package_path(package_path):
+    """Return the path of the package in the instance workspace."""
+    return f'/ws/src/{os.path.basename(package_path)}'
+
+
 class Provider(ABC):
     """Provider client."""
 
@@ -88,7 +93,11 @@ class Provider(ABC):
 
     @abstractmethod
     def _copy_from_host_to_instance(self, *, host_path, instance_path):
-        """Copy data from the instance to the host."""
+        """Copy data from the host to the instance.
+
+        The instance_path is created if needed, its parent directory is
+        expected to exist. The cloud-init configuration creates /ws/src.
+        """
         pass
 
     @abstractmethod
@@ -98,10 +107,9 @@ class Provider(ABC):
 
     def upload_package(self, package_path):
         """Upload package to instance workspace."""
-        package_name = os.path.basename(package_path)
-        instance_package_path = f'/ws/src/{package_name}'
-        self.upload_directory(host_path=package_path,
-                              instance_path=instance_package_path)
+        self.upload_directory(
+            host_path=package_path,
+            instance_path=_instance_package_path(package_path))
 
     def upload_directory(self, *, host_path, instance_path):
         """Upload package to instance workspace."""
@@ -109,12 +117,39 @@ class Provider(ABC):
         if not os.path.isdir(host_path):
             raise exceptions.FileNotFoundInHostError(host_path)
 
-        self.execute_command(['mkdir', '-p', instance_path])
         self._copy_from_host_to_instance(
             host_path=host_path,
             instance_path=instance_path
         )
 
+    def supports_bind_mount(self):
+        """Return whether host directories can be mounted in the instance."""
+        return False
+
+    def _mount_in_instance(self, mounts):
+        """Mount host directories read-only in the instance.
+
+        mounts maps each host path to its path in the instance.
+        Providers returning True from supports_bind_mount override it.
+        """
+        raise exceptions.ProviderClientError(
+            f'{type(self).__name__} cannot mount directories in the instance')
+
+    def mount_packages(self, package_paths):
+        """Mount packages read-only in the instance workspace."""
+        mounts = {}
+        for package_path in package_paths:
+            instance_package_path = _instance_package_path(package_path)
+            logger.info(f'mounting {package_path} into the instance '
+                        f'{instance_package_path}')
+            if not os.path.isdir(package_path):
+                raise exceptions.FileNotFoundInHostError(package_path)
+            mounts[package_path] = instance_package_path
+
+        # All the directories are mounted at once, each change of
+        # the instance configuration is a round trip to the provider
+        self._mount_in_instance(mounts)
+
     @abstractmethod
     def shell(self):
         """Shell into the instance."""
@@ -42,8 +42,9 @@ class ProviderFactory(object):
     @classmethod
     def create(cls, name, ros_distro):
         """Make a provider based on the name."""
-        provider = cls._providers.get(name)
-        if not provider:
+        try:
+            provider = cls._providers[name]
+        except KeyError:
             raise exceptions.ProviderNotRegisteredError(name)
         return provider(ros_distro)  # type: ignore
 
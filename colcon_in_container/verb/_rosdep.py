@@ -13,11 +13,19 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from typing import Optional, Set
+from typing import Iterable, Optional
 
 from colcon_in_container.logging import logger
 
 
+# Dependencies needed to build a workspace
+BUILD_DEPENDENCY_TYPES = ('build',
+                          'buildtool',
+                          'build_export',
+                          'buildtool_export',
+                          'test')
+
+
 class Rosdep(object):
     """Rosdep tool class wrapper to call rosdep in a provider."""
 
@@ -33,7 +41,7 @@ class Rosdep(object):
         logger.info('Updating rosdep')
         return self.provider.execute_command(['rosdep', 'update'])
 
-    def install(self, dependency_types: Optional[Set[str]] = None):
+    def install(self, dependency_types: Optional[Iterable[str]] = None):
         """Call rosdep install on the provided dependency_types."""
         logger.info('Installing dependencies with rosdep')
         commands = [
@@ -14,9 +14,8 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from functools import partial
+from concurrent.futures import as_completed, ThreadPoolExecutor
 import sys
-from typing import Callable, List
 
 from colcon_core.package_selection import add_arguments \
     as add_packages_arguments
@@ -27,10 +26,15 @@ from colcon_in_container.providers.provider_factory import ProviderFactory
 from colcon_in_container.verb._parser import \
     add_instance_argument, add_ros_distro_argument,\
     verify_ros_distro_in_parsed_args
-from colcon_in_container.verb._rosdep import Rosdep
+from colcon_in_container.verb._rosdep import BUILD_DEPENDENCY_TYPES, Rosdep
 from colcon_in_container.verb.in_container import InContainer
 
 
+# Maximum number of packages uploaded concurrently, each upload may
+# use several connections or processes of its own
+_UPLOAD_WORKERS = 4
+
+
 class BuildInContainerVerb(InContainer):
     """Call a colcon build command inside a fresh container."""
 
@@ -50,14 +54,42 @@ class BuildInContainerVerb(InContainer):
             'Arguments matching other options must be prefixed by a space.',
         )
 
+        parser.add_argument(
+            '--mount-sources',
+            action='store_true',
+            help='Mount the selected packages read-only in the instance '
+                 'instead of uploading them. Only supported by the lxd '
+                 'provider, packages writing in their source directory '
+                 'will fail to build. In an unprivileged container the '
+                 'host files are owned by nobody:nogroup, only world '
+                 'readable sources can be built.',
+        )
+
         add_instance_argument(parser)
         add_packages_arguments(parser)
 
+    def _upload_packages(self, packages):
+        """Upload the packages in the instance workspace."""
+        # uploads are independent from each other, overlap them.
+        # The LXD provider also bounds the transfers running at once
+        # across all the uploads.
+        with ThreadPoolExecutor(max_workers=_UPLOAD_WORKERS) as executor:
+            uploads = {
+                executor.submit(self.provider.upload_package,
+                                package.path): package
+                for package in packages}
+            for upload in as_completed(uploads):
+                upload.result()
+                logger.debug(f'{uploads[upload].name} uploaded')
+
+    def _mount_packages(self, packages):
+        """Mount the packages read-only in the instance workspace."""
+        self.provider.mount_packages([package.path for package in packages])
+
     def _colcon_build(self, colcon_build_args):
         logger.info(f'building workspace with args: {colcon_build_args}')
         return self.provider.execute_commands([
-            f'colcon --log-level={logger.getEffectiveLevel()} '
-            f'build {colcon_build_args}'])
+            self._colcon_build_command + colcon_build_args])
 
     def _build(self, args):
         """Build the workspace.
@@ -65,28 +97,30 @@ class BuildInContainerVerb(InContainer):
         Pull build-time dependencies, build the workspace and download the
         result build directory.
         """
-        commands: List[Callable[[], int]] = [
-            partial(self.rosdep.install,
-                    {'build',
-                     'buildtool',
-                     'build_export',
-                     'buildtool_export',
-                     'test'}),
-            partial(self._colcon_build, args.colcon_build_args)]
-        for command in commands:
-            exit_code = command()
+        # each step only runs once the previous one succeeded
+        commands = ((self.rosdep.install, (BUILD_DEPENDENCY_TYPES,)),
+                    (self._colcon_build, (args.colcon_build_args,)))
+        for command, command_args in commands:
+            exit_code = command(*command_args)
             if exit_code:
                 return exit_code
 
+        # install and build are disjoint, download them concurrently
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            downloads = [
+                executor.submit(
+                    self.provider.download_result,
+                    result_path_in_instance=self.instance_workspace_path
+                    + 'install',
+                    result_path_on_host=self.host_install_in_container_folder),
+                executor.submit(
+                    self.provider.download_result,
+                    result_path_in_instance=self.instance_workspace_path
+                    + 'build',
+                    result_path_on_host=self.host_build_in_container_folder)]
         try:
-            self.provider.download_result(
-                result_path_in_instance=self.instance_workspace_path
-                + 'install',
-                result_path_on_host=self.host_install_in_container_folder)
-            self.provider.download_result(
-                result_path_in_instance=self.instance_workspace_path
-                + 'build',
-                result_path_on_host=self.host_build_in_container_folder)
+            for download in as_completed(downloads):
+                download.result()
         except provider_exceptions.FileNotFoundInInstanceError:
             return 1
         return 0
@@ -96,6 +130,10 @@ class BuildInContainerVerb(InContainer):
         if not verify_ros_distro_in_parsed_args(context.args):
             sys.exit(1)
 
+        # the log level is only final once colcon parsed the arguments
+        self._colcon_build_command = \
+            f'colcon --log-level={logger.getEffectiveLevel()} build '
+
         self.provider = ProviderFactory.create(context.args.provider,
                                                context.args.ros_distro)
         try:
@@ -106,17 +144,30 @@ class BuildInContainerVerb(InContainer):
             exit_code = 1
         else:
             self.rosdep = Rosdep(self.provider, context.args.ros_distro)
-            self.rosdep.update()
-            # copy packages into the instance
-            decorators = get_packages(context.args,
-                                      recursive_categories=('run', ))
-            logger.info(f'Discovered {len(decorators)} packages, '
-                        'uploading them in the instance')
-            for decorator in decorators:
-                package = decorator.descriptor
-                if not decorator.selected:
-                    continue
-                self.provider.upload_package(package.path)
+            # rosdep update does not depend on the sources,
+            # run it while the packages are being copied
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                rosdep_update = executor.submit(self.rosdep.update)
+                # copy packages into the instance
+                decorators = get_packages(context.args,
+                                          recursive_categories=('run', ))
+                selected_packages = [decorator.descriptor
+                                     for decorator in decorators
+                                     if decorator.selected]
+                mount_sources = context.args.mount_sources and \
+                    self.provider.supports_bind_mount()
+                if context.args.mount_sources and not mount_sources:
+                    logger.warn(f'The {context.args.provider} provider '
+                                'cannot mount sources, uploading them.')
+                if mount_sources:
+                    logger.info(f'Discovered {len(decorators)} packages, '
+                                'mounting them in the instance')
+                    self._mount_packages(selected_packages)
+                else:
+                    logger.info(f'Discovered {len(decorators)} packages, '
+                                'uploading them in the instance')
+                    self._upload_packages(selected_packages)
+                rosdep_update.result()
             exit_code = self._build(context.args)
 
         if exit_code != 0:
@@ -28,7 +28,7 @@ from colcon_in_container.providers.provider_factory import ProviderFactory
 from colcon_in_container.verb._parser import \
     add_instance_argument, add_ros_distro_argument,\
     verify_ros_distro_in_parsed_args
-from colcon_in_container.verb._rosdep import Rosdep
+from colcon_in_container.verb._rosdep import BUILD_DEPENDENCY_TYPES, Rosdep
 from colcon_in_container.verb.in_container import InContainer
 
 
@@ -119,16 +119,11 @@ class ReleaseInContainerVerb(InContainer):
         """Release the package.
 
         Run bloom-generate rosdebian|debian.
+        The dependencies must have been installed beforehand.
 
         Raise: ChildProcessError when a command fails in the container.
         """
         commands: List[Callable[[], int]] = [
-            partial(self.rosdep.install,
-                    {'build',
-                     'buildtool',
-                     'build_export',
-                     'buildtool_export',
-                     'test'}),
             partial(self._bloom_generate, package_name, args.bloom_generator),
             partial(self._generate_binary, package_name),
             partial(self._save_results, package_name)]
@@ -187,6 +182,13 @@ class ReleaseInContainerVerb(InContainer):
             if not package_names:
                 raise FileNotFoundError('No package found for release')
 
+            # rosdep resolves the dependencies of every package in /ws/src
+            # at once, install them a single time rather than per package
+            exit_code = self.rosdep.install(BUILD_DEPENDENCY_TYPES)
+            if exit_code:
+                raise SystemError('Failed to install dependencies '
+                                  f'with error code {exit_code}')
+
             for package in package_names:
                 try:
                     self._release_package(package, context.args)
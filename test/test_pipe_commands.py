@@ -0,0 +1,64 @@
+# Copyright (C) 2023 Canonical, Ltd.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+from colcon_in_container.providers import exceptions
+from colcon_in_container.providers._helper import check_pipe_download, \
+    pipe_commands
+import pytest
+
+
+def _download(source_path, destination_path):
+    os.mkdir(destination_path)
+    return_codes = pipe_commands(
+        ['tar', '-C', str(source_path), '-cf', '-', '.'],
+        ['tar', '-C', str(destination_path), '-xf', '-'])
+    check_pipe_download(return_codes, instance_path=str(source_path),
+                        host_path=str(destination_path))
+
+
+def test_download(tmp_path):
+    source_path = tmp_path / 'source'
+    source_path.mkdir()
+    (source_path / 'file').write_text('content')
+    destination_path = tmp_path / 'destination'
+
+    _download(source_path, destination_path)
+
+    assert (destination_path / 'file').read_text() == 'content'
+
+
+def test_download_missing_source(tmp_path):
+    destination_path = tmp_path / 'destination'
+
+    with pytest.raises(exceptions.FileNotFoundInInstanceError):
+        _download(tmp_path / 'missing', destination_path)
+    assert not destination_path.exists()
+
+
+def test_download_consumer_failure(tmp_path):
+    source_path = tmp_path / 'source'
+    source_path.mkdir()
+    (source_path / 'file').write_text('content')
+    destination_path = tmp_path / 'destination'
+
+    with pytest.raises(exceptions.ProviderClientError):
+        check_pipe_download(
+            pipe_commands(
+                ['tar', '-C', str(source_path), '-cf', '-', '.'],
+                ['tar', '-C', str(destination_path), '-xf', '-']),
+            instance_path=str(source_path),
+            host_path=str(destination_path))